@@ -1,17 +1,58 @@
 #!/usr/bin/python3
 
-from which_pyqt import PYQT_VER
-
-if PYQT_VER == 'PYQT5':
-    from PyQt5.QtCore import QLineF, QPointF
-elif PYQT_VER == 'PYQT4':
-    from PyQt4.QtCore import QLineF, QPointF
-else:
-    raise Exception('Unsupported Version of PyQt: {}'.format(PYQT_VER))
-
+import ctypes
 import math
+import multiprocessing
+import os
+import sys
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# The compiled fills in _kernels.py need numba; without it, their ahead-of-time build is used if there is one
+try:
+    import _kernels as _nw_kernels
+except ImportError:
+    try:
+        import genealign_kernels as _nw_kernels
+    except ImportError:
+        _nw_kernels = None
+_NUMBA_AVAILABLE = _nw_kernels is not None
+
+# The Cython fill in nw_cython.pyx is optional too, for where numba is not available (see setup.py to build it)
+try:
+    from nw_cython import nw_fill as _cy_nw_fill
+    _CYTHON_AVAILABLE = True
+except ImportError:
+    _CYTHON_AVAILABLE = False
+
+# CUDA is only used for batches of score-only alignments (batch_unrestricted_scores)
+_CUDA_AVAILABLE = False
+try:
+    import numba
+    from numba import cuda
+    _CUDA_AVAILABLE = cuda.is_available()
+except Exception:  # no numba, or a missing toolkit or driver; the CPU path is used instead
+    pass
+
+# The SIMD fill in genealign_simd.c is optional; build it next to this file to enable it (see the top of that file).
+# ctypes.CDLL releases the GIL for the duration of each call, like the nogil numba kernels below
+try:
+    _simd = ctypes.CDLL(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     'genealign_simd' + {'win32': '.dll', 'darwin': '.dylib'}.get(sys.platform, '.so')))
+    # one entry point per score dtype of E
+    _simd_fill = {np.dtype(np.int32): _simd.fill_unrestricted, np.dtype(np.int16): _simd.fill_unrestricted16}
+    for _dtype, _fill in _simd_fill.items():
+        _fill.argtypes = [np.ctypeslib.ndpointer(np.uint8, flags='C_CONTIGUOUS'), ctypes.c_int,
+                          np.ctypeslib.ndpointer(np.uint8, flags='C_CONTIGUOUS'), ctypes.c_int,
+                          np.ctypeslib.ndpointer(_dtype, flags='C_CONTIGUOUS'),
+                          np.ctypeslib.ndpointer(np.uint8, flags='C_CONTIGUOUS')]
+        _fill.restype = ctypes.c_int
+    _SIMD_AVAILABLE = True
+except (OSError, AttributeError):
+    _SIMD_AVAILABLE = False
 
 # Used to compute the bandwidth for banded version
 MAXINDELS = 3
@@ -21,6 +62,251 @@ MATCH = -3
 INDEL = 5
 SUB = 1
 
+# Substitution cost of every pair of characters, indexed by their byte values: MATCH on the diagonal, SUB elsewhere.
+# The fills look costs up here, one row per character of seq1, instead of comparing characters, so a real scoring
+# matrix is only a change to this table.  The SIMD kernel in genealign_simd.c still compares, and assumes this shape.
+SUBCOST = np.full((256, 256), SUB, dtype=np.int8)
+np.fill_diagonal(SUBCOST, MATCH)
+
+# Marks an out-of-band cell in the banded back-pointer table
+NOPTR = 3
+
+# Back-pointers of every banded pair rejected on length: empty, read-only and shared, so a rejection allocates nothing
+_NO_BAND = np.empty((0, 2 * MAXINDELS + 1), dtype=np.uint8)
+_NO_BAND.flags.writeable = False
+
+# Unrestricted alignments with more DP cells than this are traced back with Hirschberg's algorithm, in linear
+# memory, instead of from a back-pointer table (about 8000 x 8000 bases)
+HIRSCHBERG_CELLS = 1 << 26
+
+
+# The unrestricted back-pointer table is packed four 2-bit entries to a byte, (len1, (len2 + 3) // 4) uint8: entry
+# (i, j) sits in bits 2 * (j % 4) and up of byte [i, j // 4].  It must start zeroed.
+def _packed_width(len2):
+    return (len2 + 3) // 4
+
+
+#  takes a packed back-pointer table, a cell and its back-pointer (0, 1 or 2); i, j and v may also be index and
+#  value arrays naming cells in distinct bytes
+#  sets the cell's entry, which must still be 0
+def _set_p(P, i, j, v):
+    P[i, j >> 2] |= np.uint8((v & 3) << ((j & 3) * 2))
+
+
+#  takes a packed back-pointer table and a cell
+#  returns the cell's back-pointer
+def _get_p(P, i, j):
+    return (P[i, j >> 2] >> ((j & 3) * 2)) & 3
+
+
+#  takes the number of rows and columns of a DP table
+#  returns the narrowest integer dtype that holds every score of the table.  Substituting along the shorter side
+#  and gapping the rest bounds each cell by INDEL * max(rows, cols) from above, and all matches by
+#  MATCH * max(rows, cols) from below; half of the range is left free as headroom.
+#  int16 covers align_length up to about 3000.
+def _score_dtype(len1, len2):
+    if max(INDEL, SUB, -MATCH) * max(len1, len2) < np.iinfo(np.int16).max // 2:
+        return np.int16
+    return np.int32
+
+
+if _NUMBA_AVAILABLE:
+    _nw_fill = _nw_kernels.nw_fill
+    # one score-only entry point per dtype of the rows, as for _simd_fill
+    _nw_score = {np.dtype(np.int32): _nw_kernels.nw_score32, np.dtype(np.int16): _nw_kernels.nw_score16}
+
+
+#  Vectorized Needleman-Wunsch fill (Unrestricted Implementation), used when no compiled fill is available
+#  takes both sequences as uint8 arrays, the E table and the packed P, both with their first row and column set
+#  cells on one anti-diagonal (i + j == k) only depend on the two previous anti-diagonals, so each one is
+#  computed as a single numpy operation, with the same tie-breaking as getEditDistanceUnrestricted
+#  t: O(nm)  n + m vectorized steps over at most min(n, m) cells each
+#  s: O(min(n, m)) temporaries beyond the tables
+def _nw_fill_wavefront(seq1_arr, seq2_arr, E, P):
+    len1, len2 = E.shape
+    # cells of one anti-diagonal are in distinct rows, so no two of them share a byte of P
+    for k in range(2, len1 + len2 - 1):
+        i = np.arange(max(1, k - len2 + 1), min(len1, k))
+        j = k - i
+        diag = E[i - 1, j - 1] + SUBCOST[seq1_arr[i - 1], seq2_arr[j - 1]]
+        left = INDEL + E[i, j - 1]
+        up = INDEL + E[i - 1, j]
+        e = np.minimum(np.minimum(diag, left), up)
+        E[i, j] = e
+        _set_p(P, i, j, np.select([e == left, e == up], [1, 2], 0).astype(np.uint8))
+
+
+# Longest (truncated) sequence the CUDA kernel handles: three anti-diagonals of int32 scores plus both sequences
+# have to fit in one block's 48 KB of shared memory
+_CUDA_MAX_LEN = 3072
+# Threads per block in the CUDA kernel
+_CUDA_THREADS = 128
+
+if _CUDA_AVAILABLE:
+    #  Batched Needleman-Wunsch scores on the GPU (Unrestricted Implementation, score only)
+    #  takes all sequences concatenated into one uint8 array with the _offsets_ and truncated _lengths_ of each,
+    #  and SUBCOST (passed in, as it would not fit in constant memory)
+    #  block (bx, by) aligns sequence bx with sequence by and writes the edit distance to scores[bx, by]; blocks
+    #  below the diagonal return at once, the caller mirrors them.  The block's threads share the cells of one
+    #  anti-diagonal at a time, which only depend on the two before it, so the three live anti-diagonals (indexed
+    #  by i) are all that is kept, in shared memory along with both sequences.
+    #  t: O(nm / threads) per pair  s: O(n + m) per block
+    @cuda.jit
+    def _nw_batch(seqs, offsets, lengths, subcost, scores):
+        bx = cuda.blockIdx.x
+        by = cuda.blockIdx.y
+        if by < bx:
+            return
+        tid = cuda.threadIdx.x
+        D = cuda.shared.array(shape=(3, _CUDA_MAX_LEN + 1), dtype=numba.int32)
+        s1 = cuda.shared.array(shape=_CUDA_MAX_LEN, dtype=numba.uint8)
+        s2 = cuda.shared.array(shape=_CUDA_MAX_LEN, dtype=numba.uint8)
+        n = lengths[bx]
+        m = lengths[by]
+        for i in range(tid, n, _CUDA_THREADS):
+            s1[i] = seqs[offsets[bx] + i]
+        for j in range(tid, m, _CUDA_THREADS):
+            s2[j] = seqs[offsets[by] + j]
+        cuda.syncthreads()
+
+        for k in range(n + m + 1):
+            cur = k % 3
+            d1 = (k + 2) % 3  # diagonal k - 1
+            d2 = (k + 1) % 3  # diagonal k - 2
+            for i in range(max(0, k - m) + tid, min(n, k) + 1, _CUDA_THREADS):
+                j = k - i
+                if i == 0:
+                    e = 5 * j
+                elif j == 0:
+                    e = 5 * i
+                else:
+                    e = min(subcost[s1[i - 1], s2[j - 1]] + D[d2, i - 1],
+                            INDEL + D[d1, i], INDEL + D[d1, i - 1])
+                D[cur, i] = e
+            cuda.syncthreads()
+
+        if tid == 0:
+            scores[bx, by] = D[(n + m) % 3, n]
+
+
+#  Score-Only Fill (Unrestricted Implementation)
+#  takes two sequences as arguments
+#  returns the last row of E as an array of length m + 1: entry j is the edit distance of seq1 and seq2[:j]
+#  t: O(nm)  s: O(m) with numba, where only the previous and current rows of E are kept; O(n + m) otherwise.
+def _nw_last_row(seq1, seq2):
+    len1 = len(seq1) + 1
+    len2 = len(seq2) + 1
+    seq1_arr = np.frombuffer(seq1.encode('ascii'), dtype=np.uint8)
+    seq2_arr = np.frombuffer(seq2.encode('ascii'), dtype=np.uint8)
+    if _NUMBA_AVAILABLE:
+        prev = np.empty(len2, dtype=_score_dtype(len1, len2))
+        curr = np.empty(len2, dtype=prev.dtype)
+        prev[:] = 5 * np.arange(len2)
+        return _nw_score[prev.dtype](seq1_arr, seq2_arr, SUBCOST, INDEL, prev, curr)
+    return _nw_last_row_wavefront(seq1_arr, seq2_arr)
+
+
+#  Vectorized score-only fill (Unrestricted Implementation), used when numba is not installed
+#  takes both sequences as uint8 arrays
+#  returns the last row of E, as _nw_last_row.  Anti-diagonal k (i + j == k) only depends on the two before it, so,
+#  as in the CUDA kernel, three diagonals indexed by i are all that is kept and each is computed as one numpy
+#  operation; cell (n, j) lies on diagonal n + j and is copied out as the sweep passes it.
+#  t: O(nm)  n + m vectorized steps over at most min(n, m) cells each
+#  s: O(n + m)
+def _nw_last_row_wavefront(seq1_arr, seq2_arr):
+    n = len(seq1_arr)
+    m = len(seq2_arr)
+    dtype = _score_dtype(n + 1, m + 1)
+    cur, d1, d2 = (np.empty(n + 1, dtype=dtype) for _ in range(3))  # diagonals k, k - 1 and k - 2
+    last = np.empty(m + 1, dtype=dtype)
+    r2 = seq2_arr[::-1]  # seq2[k - i - 1] is r2[m - k + i], so each diagonal reads a contiguous slice
+    for k in range(n + m + 1):
+        a = max(1, k - m)  # interior cells (i >= 1, j >= 1) of the diagonal are rows a..b
+        b = min(n, k - 1)
+        if a <= b:
+            e = np.minimum(d1[a - 1:b], d1[a:b + 1])  # up, left
+            e += INDEL
+            np.minimum(e, d2[a - 1:b] + SUBCOST[seq1_arr[a - 1:b], r2[m - k + a:m - k + b + 1]], out=e)
+            cur[a:b + 1] = e
+        if k <= m:
+            cur[0] = 5 * k  # row 0
+        if k <= n:
+            cur[k] = 5 * k  # column 0
+        if k >= n:
+            last[k - n] = cur[n]
+        cur, d1, d2 = d2, cur, d1
+    return last
+
+
+#  Hirschberg's Alignment Algorithm (Unrestricted Implementation)
+#  takes two sequences as arguments
+#  returns the full optimal alignment of the two, without ever building a back-pointer table.  seq1 is split in
+#  half; the last rows of the forward DP of seq1[:mid] against seq2 and of the DP of the reversed halves give,
+#  for every split point j of seq2, the cost of aligning each half with its side.  The best j splits seq2 and
+#  both halves are aligned recursively; pieces with at most 2 characters on a side are aligned directly.
+#  t: O(nm)  about twice the work of one fill, as each level of the recursion halves the area left.
+#  s: O(n + m)
+def hirschberg(seq1, seq2):
+    if len(seq1) <= 2 or len(seq2) <= 2:
+        return _nw_small(seq1, seq2)
+    mid = len(seq1) // 2
+    forward = _nw_last_row(seq1[:mid], seq2).astype(np.int64)
+    backward = _nw_last_row(seq1[mid:][::-1], seq2[::-1]).astype(np.int64)
+    split = int(np.argmin(forward + backward[::-1]))
+    left1, left2 = hirschberg(seq1[:mid], seq2[:split])
+    right1, right2 = hirschberg(seq1[mid:], seq2[split:])
+    return left1 + right1, left2 + right2
+
+
+#  takes two sequences, at least one of them short, as arguments
+#  returns their full optimal alignment, filling the whole table; used for the base case of hirschberg
+#  t: O(nm)  s: O(nm)
+def _nw_small(seq1, seq2):
+    len1 = len(seq1) + 1
+    len2 = len(seq2) + 1
+    E = [[5 * j for j in range(len2)]] + [[5 * i] + [0] * (len2 - 1) for i in range(1, len1)]
+    P = [[1] * len2] + [[2] * len2 for _ in range(1, len1)]
+    for i in range(1, len1):
+        row_sub = SUBCOST[ord(seq1[i - 1])].tolist()
+        for j in range(1, len2):
+            e = INDEL + E[i][j - 1]  # left
+            p = 1
+            up = INDEL + E[i - 1][j]
+            if up < e:
+                e = up
+                p = 2
+            diag = row_sub[ord(seq2[j - 1])] + E[i - 1][j - 1]
+            if diag < e:
+                e = diag
+                p = 0
+            E[i][j] = e
+            P[i][j] = p
+    i, j = len1 - 1, len2 - 1
+    seq1_aligned = []
+    seq2_aligned = []
+    while i > 0 or j > 0:
+        if P[i][j] == 2:
+            seq1_aligned.append(seq1[i - 1])
+            seq2_aligned.append("-")
+            i -= 1
+        elif P[i][j] == 0:
+            seq1_aligned.append(seq1[i - 1])
+            seq2_aligned.append(seq2[j - 1])
+            i -= 1
+            j -= 1
+        else:
+            seq1_aligned.append("-")
+            seq2_aligned.append(seq2[j - 1])
+            j -= 1
+    return ''.join(reversed(seq1_aligned)), ''.join(reversed(seq2_aligned))
+
+
+#  takes two aligned sequences (with '-' for gaps) as arguments
+#  returns the cost of the alignment
+def _alignment_cost(seq1_aligned, seq2_aligned):
+    return sum(INDEL if a == '-' or b == '-' else int(SUBCOST[ord(a), ord(b)])
+               for a, b in zip(seq1_aligned, seq2_aligned))
+
 
 class GeneSequencing:
 
@@ -29,22 +315,34 @@ class GeneSequencing:
 
     # This is the method called by the GUI.  _seq1_ and _seq2_ are two sequences to be aligned, _banded_ is a boolean
     # that tells you whether you should compute a banded alignment or full alignment, and _align_length_ tells you
-    # how many base pairs to use in computing the alignment
+    # how many base pairs to use in computing the alignment.  With _score_only_ set, only the cost is computed and
+    # the alignment strings are returned as None.
 
-    def align(self, seq1, seq2, banded, align_length):
+    def align(self, seq1, seq2, banded, align_length, score_only=False):
         self.banded = banded
         self.MaxCharactersToAlign = align_length
 
-        score, P = self.getEditDistance(seq1, seq2)
+        if not banded and not score_only and \
+                min(len(seq1), align_length) * min(len(seq2), align_length) > HIRSCHBERG_CELLS:
+            alignment1, alignment2 = hirschberg(seq1[:align_length], seq2[:align_length])
+            return {'align_cost': _alignment_cost(alignment1, alignment2),
+                    'seqi_first100': alignment1[:100], 'seqj_first100': alignment2[:100]}
+        score, P = self.getEditDistance(seq1, seq2, score_only)
+        if score_only:
+            return {'align_cost': score, 'seqi_first100': None, 'seqj_first100': None}
         alignment1, alignment2 = self.aligned(seq1, seq2, P)
 
         return {'align_cost': score, 'seqi_first100': alignment1, 'seqj_first100': alignment2}
 
     # takes two sequences as arguments
     # returns banded edit distance if self.banded is true; otherwise, returns unrestricted edit distance
-    def getEditDistance(self, seq1, seq2):
+    # the back-pointers are None when _score_only_ is set and the unrestricted score is computed on two rows
+    def getEditDistance(self, seq1, seq2, score_only=False):
         if self.banded:
-            return self.getEditDistanceBanded(seq1, seq2)
+            score, P = self.getEditDistanceBanded(seq1, seq2)
+            return score, None if score_only else P
+        elif score_only:
+            return self.getEditScoreUnrestricted(seq1, seq2), None
         else:
             return self.getEditDistanceUnrestricted(seq1, seq2)
 
@@ -52,99 +350,127 @@ class GeneSequencing:
     #  takes two sequences as arguments
     #  returns banded edit distance and 2D array of back-pointers
     #  t: O(kn)  outer loop of double for-loop iterates n times. inner for-loop iterates k times.
-    #  s: O(kn)  two 2-dimensional arrays (E & P) of size n x k are created.
+    #  s: O(kn)  P and the table of substitution costs are n x k; only two rows of E are kept.
     def getEditDistanceBanded(self, seq1, seq2):
+        # reject on the truncated lengths before anything is sliced or allocated
+        if abs(min(len(seq1), self.MaxCharactersToAlign) - min(len(seq2), self.MaxCharactersToAlign)) > MAXINDELS:
+            return math.inf, _NO_BAND
         seq1 = seq1[:self.MaxCharactersToAlign]
         seq2 = seq2[:self.MaxCharactersToAlign]
         len1 = len(seq1) + 1  # n = len1 = len(seq1) (or align length)
         len2 = 2 * MAXINDELS + 1  # k = len2 = 2d + 1
-        if abs(len(seq1) - len(seq2)) > MAXINDELS:
-            return math.inf, []
+        if seq1 == seq2:  # identical: the DP is not needed
+            return self.identicalBanded(len1, len2)
 
-        E = []
+        # pypy-friendly: module globals and len() are bound to locals so the loop does no global or attribute lookups
+        indel = INDEL
+        d = MAXINDELS
+        last = len(seq2)
+        # substitution cost of every band cell, all looked up at once: cell j of row i holds seq1[i - 1] against
+        # seq2[i + j - d - 1], clamped into seq2 for the cells outside it, which are never read
+        seq1_arr = np.frombuffer((' ' + seq1).encode('ascii'), dtype=np.uint8)
+        seq2_arr = np.frombuffer((seq2 or ' ').encode('ascii'), dtype=np.uint8)
+        cols = np.clip(np.arange(len1)[:, None] + np.arange(len2) - d - 1, 0, len(seq2_arr) - 1)
+        sub_rows = SUBCOST[seq1_arr[:, None], seq2_arr[cols]].tolist()
+        # the fill works on Python lists, which are much cheaper to index one cell at a time than numpy arrays; only
+        # the previous row of E is kept, and P is made an array once at the end.  Only the in-band cells of each row
+        # are filled, P marking the others NOPTR
         P = []
+        above = None
         for i in range(len1):  # t: O(kn)  s: O(kn)
-            E.append([])
-            P.append([])
-            for j in range(len2):
-                if len(seq2) >= i + j - MAXINDELS >= 0:
-                    if i == 0:
-                        E[i].append(5 * (j - MAXINDELS))
-                        P[i].append(1)
-                    else:
-                        if j == len2 - 1:
-                            e = min(self.diff(seq1[i - 1], seq2[i + j - MAXINDELS - 1]) + E[i - 1][j], INDEL + E[i][j - 1])
-                            if e == INDEL + E[i][j - 1]:
-                                P[i].append(1)
-                            else:
-                                P[i].append(0)
-                        elif j == 0:
-                            e = min(self.diff(seq1[i - 1], seq2[i + j - MAXINDELS - 1]) + E[i - 1][j],
-                                    INDEL + E[i - 1][j + 1])
-                            if e == INDEL + E[i - 1][j + 1]:
-                                P[i].append(2)
-                            else:
-                                P[i].append(0)
-                        else:
-                            e = min(self.diff(seq1[i - 1], seq2[i + j - MAXINDELS - 1]) + E[i - 1][j], INDEL + E[i][j - 1],
-                                    INDEL + E[i - 1][j + 1])
-                            if e == INDEL + E[i][j - 1]:
-                                P[i].append(1)
-                            elif e == INDEL + E[i - 1][j + 1]:
-                                P[i].append(2)
-                            else:
-                                P[i].append(0)
-                        E[i].append(e)
+            # band cell j of row i stands for column i + j - d of seq2; keep to the columns 0..len(seq2)
+            j_lo = max(0, d - i)
+            j_hi = min(len2, d + last - i + 1)
+            row = [0] * len2
+            p_row = [NOPTR] * len2
+            sub = sub_rows[i]
+            for j in range(j_lo, j_hi):
+                if i == 0:
+                    e = 5 * (j - d)
+                    p_row[j] = 1
+                elif i + j == d:
+                    # first column of the full table, only reachable from above
+                    e = indel + above[j + 1]
+                    p_row[j] = 2
                 else:
-                    E[i].append(math.inf)
-                    P[i].append(math.inf)
-        ret_j = len2 - 1
-        ret = E[len1 - 1][ret_j]
-        while ret == math.inf:
-            ret_j -= 1
-            ret = E[len1 - 1][ret_j]
-        return ret, P
+                    # each term is computed once and the minimum and its pointer picked together: taken in the
+                    # order diagonal, up, left, with ties going to the later one
+                    e = sub[j] + above[j]
+                    p = 0
+                    if j < len2 - 1:
+                        up = indel + above[j + 1]
+                        if up <= e:
+                            e = up
+                            p = 2
+                    if j > 0:
+                        left = indel + row[j - 1]
+                        if left <= e:
+                            e = left
+                            p = 1
+                    p_row[j] = p
+                row[j] = e
+            P.append(p_row)
+            above = row
+        # the last row ends in column len(seq2), which always lies inside the band
+        return above[d + last - (len1 - 1)], np.array(P, dtype=np.uint8)
+
+    #  takes the banded table dimensions of two identical sequences
+    #  returns their banded edit distance (all matches) and back-pointers straight down the middle diagonal
+    #  t: O(kn)  s: O(kn)  filling P; no DP is run.
+    def identicalBanded(self, len1, len2):
+        P = np.full((len1, len2), NOPTR, dtype=np.uint8)
+        P[0, MAXINDELS] = 1
+        P[1:, MAXINDELS] = 0
+        return MATCH * (len1 - 1), P
 
     #  Edit Distance Algorithm (Unrestricted Implementation)
     #  takes two sequences as arguments
     #  returns unrestricted edit distance and 2D array of back-pointers
     #  t: O(nm)  outer loop of double for-loop iterates n times. inner for-loop iterates m times.
-    #  s: O(nm)  two 2-dimensional arrays (E & P) of size n x m are created.
+    #  s: O(nm)  two 2-dimensional arrays (E & P) of size n x m are created; P packs 4 entries to a byte.
     def getEditDistanceUnrestricted(self, seq1, seq2):
         len1 = min(len(seq1), self.MaxCharactersToAlign) + 1  # n = len1 = len(seq1) (or align length)
         len2 = min(len(seq2), self.MaxCharactersToAlign) + 1  # m = len2 = len(seq2) (or align length)
-        E = []
-        P = []
-        for i in range(len1):  # t: O(n)  s: O(2n)
-            E.append([5 * i])
-            P.append([0])
-        for j in range(1, len2):  # t: O(m)  s: O(2m)
-            E[0].append(5 * j)
-            P[0].append(1)
-        for i in range(1, len1):  # t: O(nm)  s: O(2nm)
-            for j in range(1, len2):
-                e = min(self.diff(seq1[i - 1], seq2[j - 1]) + E[i - 1][j - 1], INDEL + E[i][j - 1], INDEL + E[i - 1][j])
-                E[i].append(e)
-                if e == INDEL + E[i][j - 1]:
-                    P[i].append(1)
-                elif e == INDEL + E[i - 1][j]:
-                    P[i].append(2)
-                else:
-                    P[i].append(0)
-        return E[len1 - 1][len2 - 1], P
+        P = np.zeros((len1, _packed_width(len2)), dtype=np.uint8)
+        P[1:, 0] = 2  # column 0 points up
+        P[0, :] = 0x55  # row 0 points left
+        seq1_arr = np.frombuffer(seq1[:len1 - 1].encode('ascii'), dtype=np.uint8)
+        seq2_arr = np.frombuffer(seq2[:len2 - 1].encode('ascii'), dtype=np.uint8)
+        if _NUMBA_AVAILABLE and not _SIMD_AVAILABLE:
+            # difference-encoded fill: E itself is never allocated
+            dH = np.empty(len2, dtype=np.int8)
+            dV = np.empty(len1, dtype=np.int8)
+            return int(_nw_fill(seq1_arr, seq2_arr, SUBCOST, INDEL, dH, dV, P)), P  # t: O(nm)  s: O(nm)
+        E = np.empty((len1, len2), dtype=_score_dtype(len1, len2))
+        E[:, 0] = 5 * np.arange(len1)  # t: O(n)  s: O(2n)
+        E[0, :] = 5 * np.arange(len2)  # t: O(m)  s: O(2m)
+        if _SIMD_AVAILABLE:
+            if _simd_fill[E.dtype](seq1_arr, len1 - 1, seq2_arr, len2 - 1, E, P) != 0:  # t: O(nm)  s: O(2nm)
+                raise MemoryError('genealign_simd could not allocate its reversed copy of seq2')
+        elif _CYTHON_AVAILABLE:
+            _cy_nw_fill(seq1_arr, seq2_arr, SUBCOST, INDEL, E, P)  # t: O(nm)  s: O(2nm)
+        else:
+            _nw_fill_wavefront(seq1_arr, seq2_arr, E, P)  # t: O(nm)  s: O(2nm)
+        return int(E[len1 - 1, len2 - 1]), P
+
+    #  Edit Distance Algorithm (Unrestricted Implementation, score only)
+    #  takes two sequences as arguments
+    #  returns unrestricted edit distance without building back-pointers
+    #  t: O(nm)  outer loop of double for-loop iterates n times. inner for-loop iterates m times.
+    #  s: O(m)   only the previous and current rows of E (each of size m) are kept.
+    def getEditScoreUnrestricted(self, seq1, seq2):
+        return int(_nw_last_row(seq1[:self.MaxCharactersToAlign], seq2[:self.MaxCharactersToAlign])[-1])
 
     #  takes two characters as arguments
-    #  returns MATCH if characters match; otherwise, returns SUB
+    #  returns their substitution cost from SUBCOST: MATCH if characters match; otherwise, SUB
+    #  (the DP loops look costs up a row of SUBCOST at a time instead; kept for callers of the old interface)
     def diff(self, i, j):  # t: O(1)
-        if i == j:
-            return MATCH
-        else:
-            return SUB
+        return int(SUBCOST[ord(i), ord(j)])
 
     #  takes two sequences and a 2D array of back-pointers as arguments
     #  returns first 100 characters of each sequence aligned using the back-pointers
     def aligned(self, seq1, seq2, P):
-        if not P:
+        if len(P) == 0:
             return "No Alignment Possible", "No Alignment Possible"
         if self.banded:
             return self.alignedBanded(seq1, seq2, P)
@@ -155,52 +481,132 @@ class GeneSequencing:
     #  takes two sequences and a 2D array of back-pointers as arguments
     #  returns first 100 characters of each sequence aligned using the back-pointers
     def alignedBanded(self, seq1, seq2, P):
+        # the last row ends in the band cell of column len(seq2), truncated to the align length
         i = len(P) - 1
-        j = len(P[i]) - 1
-        while P[i][j] == math.inf:
-            j -= 1
+        j = MAXINDELS + min(len(seq2), self.MaxCharactersToAlign) - i
+        assert P[i][j] != NOPTR
 
-        seq1_aligned = seq2_aligned = ''
+        # characters are collected back to front and reversed once at the end
+        seq1_aligned = []
+        seq2_aligned = []
 
         while not (i == 0 and j == MAXINDELS):
             if P[i][j] == 2:
-                seq1_aligned = seq1[i - 1] + seq1_aligned
-                seq2_aligned = "-" + seq2_aligned
+                seq1_aligned.append(seq1[i - 1])
+                seq2_aligned.append("-")
                 i -= 1
                 j += 1
             elif P[i][j] == 0:
-                seq1_aligned = seq1[i - 1] + seq1_aligned
-                seq2_aligned = seq2[i + j - MAXINDELS - 1] + seq2_aligned
+                seq1_aligned.append(seq1[i - 1])
+                seq2_aligned.append(seq2[i + j - MAXINDELS - 1])
                 i -= 1
             else:
-                seq1_aligned = "-" + seq1_aligned
-                seq2_aligned = seq2[i + j - MAXINDELS - 1] + seq2_aligned
+                seq1_aligned.append("-")
+                seq2_aligned.append(seq2[i + j - MAXINDELS - 1])
                 j -= 1
 
-        return seq1_aligned[:100], seq2_aligned[:100]
+        return ''.join(reversed(seq1_aligned))[:100], ''.join(reversed(seq2_aligned))[:100]
 
     #  Alignment Extraction Algorithm (Unrestricted Implementation)
     #  takes two sequences and a 2D array of back-pointers as arguments
     #  returns first 100 characters of each sequence aligned using the back-pointers
     def alignedUnrestricted(self, seq1, seq2, P):
         i = len(P) - 1
-        j = len(P[i]) - 1
+        j = min(len(seq2), self.MaxCharactersToAlign)  # P is packed, so its width does not give the column count
 
-        seq1_aligned = seq2_aligned = ''
+        # characters are collected back to front and reversed once at the end
+        seq1_aligned = []
+        seq2_aligned = []
 
         while i > 0 or j > 0:
-            if P[i][j] == 2:
-                seq1_aligned = seq1[i - 1] + seq1_aligned
-                seq2_aligned = "-" + seq2_aligned
+            p = _get_p(P, i, j)
+            if p == 2:
+                seq1_aligned.append(seq1[i - 1])
+                seq2_aligned.append("-")
                 i -= 1
-            elif P[i][j] == 0:
-                seq1_aligned = seq1[i - 1] + seq1_aligned
-                seq2_aligned = seq2[j - 1] + seq2_aligned
+            elif p == 0:
+                seq1_aligned.append(seq1[i - 1])
+                seq2_aligned.append(seq2[j - 1])
                 i -= 1
                 j -= 1
             else:
-                seq1_aligned = "-" + seq1_aligned
-                seq2_aligned = seq2[j - 1] + seq2_aligned
+                seq1_aligned.append("-")
+                seq2_aligned.append(seq2[j - 1])
                 j -= 1
 
-        return seq1_aligned[:100], seq2_aligned[:100]
+        return ''.join(reversed(seq1_aligned))[:100], ''.join(reversed(seq2_aligned))[:100]
+
+
+#  Batched Edit Distance (Unrestricted Implementation, score only)
+#  takes a list of sequences and the align length
+#  returns an N x N array whose [i, j] entry is the unrestricted edit distance of sequences i and j, as the GUI's
+#  table would show it.  On a CUDA GPU every pair is one thread block of a single launch; otherwise, or when a
+#  sequence is longer than the kernel's shared memory allows, each pair goes through the CPU score-only path.
+#  t: O(N^2 nm)  s: O(N n) on the device, O(N^2) for the result
+def batch_unrestricted_scores(seqs, align_length):
+    N = len(seqs)
+    seqs = [seq[:align_length] for seq in seqs]
+    scores = np.zeros((N, N), dtype=np.int64)
+    if _CUDA_AVAILABLE and all(len(seq) <= _CUDA_MAX_LEN for seq in seqs):
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int32)
+        offsets = np.zeros(N, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)[:-1]
+        packed = np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8)
+        d_scores = cuda.to_device(np.zeros((N, N), dtype=np.int32))
+        if N > 0:
+            _nw_batch[(N, N), _CUDA_THREADS](cuda.to_device(packed if len(packed) else np.zeros(1, np.uint8)),
+                                             cuda.to_device(offsets), cuda.to_device(lengths),
+                                             cuda.to_device(SUBCOST), d_scores)
+        scores[:] = d_scores.copy_to_host()
+    else:
+        solver = GeneSequencing()
+        for i in range(N):
+            for j in range(i, N):
+                scores[i, j] = solver.align(seqs[i], seqs[j], banded=False, align_length=align_length,
+                                            score_only=True)['align_cost']
+    # only the upper triangle was computed; the cost is symmetric
+    iu = np.triu_indices(N, 1)
+    scores[(iu[1], iu[0])] = scores[iu]
+    return scores
+
+
+#  takes a (seq1, seq2, banded, align_length) tuple
+#  returns the result of align for that pair.  Each call gets its own solver, since align keeps its arguments on self
+def _align_pair(task):
+    seq1, seq2, banded, align_length = task
+    return GeneSequencing().align(seq1, seq2, banded=banded, align_length=align_length)
+
+
+#  takes a list of (seq1, seq2) pairs, _banded_ and the align length, as for align
+#  returns the list of align results, in the order of _pairs_.  The unrestricted fills run in the compiled
+#  kernels with the GIL released, so pairs are spread over one thread per core; the banded fill and the pure-Python
+#  fallback hold the GIL, so they are spread over one process per core instead.
+def _align_pairs(pairs, banded, align_length):
+    tasks = [(seq1, seq2, banded, align_length) for seq1, seq2 in pairs]
+    workers = os.cpu_count()
+    if not banded and (_SIMD_AVAILABLE or _NUMBA_AVAILABLE or _CYTHON_AVAILABLE):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_align_pair, tasks))
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(_align_pair, tasks)
+
+
+#  Batched Alignment
+#  takes two lists of sequences, _banded_ and the align length, as for align
+#  returns a table (list of lists) whose [a][b] entry is the result of aligning seqs_i[a] with seqs_j[b].  For a
+#  banded alignment, the pairs whose truncated lengths differ by more than MAXINDELS are rejected all at once
+#  through one comparison of the two length vectors, and only the rest are aligned (see _align_pairs).
+def align_many(seqs_i, seqs_j, banded=True, align_length=3000):
+    lens_i = np.minimum([len(seq) for seq in seqs_i], align_length).astype(np.int64)
+    lens_j = np.minimum([len(seq) for seq in seqs_j], align_length).astype(np.int64)
+    bad = np.zeros((len(seqs_i), len(seqs_j)), dtype=bool)
+    if banded:
+        bad = np.abs(lens_i[:, None] - lens_j[None, :]) > MAXINDELS
+    rejected = {'align_cost': math.inf,
+                'seqi_first100': 'No Alignment Possible', 'seqj_first100': 'No Alignment Possible'}
+    results = [[dict(rejected) for _ in seqs_j] for _ in seqs_i]
+    feasible = np.argwhere(~bad)
+    aligned = _align_pairs([(seqs_i[a], seqs_j[b]) for a, b in feasible], banded, align_length)
+    for (a, b), result in zip(feasible, aligned):
+        results[a][b] = result
+    return results
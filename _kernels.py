@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+# Compiled Needleman-Wunsch kernels for GeneSequencing.py.  Importing this module needs numba: the kernels are
+# JIT-compiled with cache=True, so the machine code is kept in __pycache__ and only built on the first run, and they
+# are called once at import time for the argument types GeneSequencing uses, so the first align() does not pay for
+# loading or compiling them (set GENEALIGN_WARMUP=0 to skip that).
+#
+# Without numba at run time, build them ahead of time on a machine that has it:
+#     python _kernels.py
+# writes the genealign_kernels extension next to this file, which GeneSequencing.py falls back to.
+#
+# The scoring (the SUBCOST table and INDEL) is passed in rather than read from GeneSequencing's globals, which
+# numba would freeze into the cached code.
+
+import os
+
+import numba
+import numpy as np
+
+
+#  Compiled Needleman-Wunsch fill (Unrestricted Implementation)
+#  takes both sequences as uint8 arrays, the substitution cost table and indel cost, the int8 vectors dH (length m)
+#  and dV (length n), and the packed P with its first row and column already set
+#  fills the rest of P in place, using the same tie-breaking as getEditDistanceUnrestricted, and returns the
+#  edit distance.  E is never stored: with a = E[i-1][j-1], the up and left cells are a + dH[j] (dH holding
+#  E[i-1][j] - E[i-1][j-1] from the row above) and a + dV_left (E[i][j-1] - E[i-1][j-1]), so
+#      z = E[i][j] - a = min(diff, dV_left + INDEL, dH[j] + INDEL)
+#  and the new differences are dH[j] = z - dV_left, dV = z - dH[j].  Every difference lies in MATCH - INDEL ..
+#  INDEL, whatever the sequence lengths.  dV down the last column is kept in _dV_, and the distance is E[0][m]
+#  plus its sum.
+#  t: O(nm)  s: O(n + m) beyond P
+@numba.njit(cache=True, boundscheck=False, nogil=True)
+def nw_fill(seq1_arr, seq2_arr, subcost, indel, dH, dV, P):
+    len1 = seq1_arr.shape[0] + 1
+    len2 = seq2_arr.shape[0] + 1
+    dH[:] = indel  # row 0
+    dV[0] = 0
+    for i in range(1, len1):
+        dV_left = indel  # column 0
+        sub = subcost[seq1_arr[i - 1]]
+        for j in range(1, len2):
+            # minimum and pointer together, ties going to left over up over diagonal
+            left = dV_left + indel
+            z = left
+            p = 1
+            up = dH[j] + indel
+            if up < z:
+                z = up
+                p = 2
+            diag = sub[seq2_arr[j - 1]]
+            if diag < z:
+                z = diag
+                p = 0
+            # _set_p, inlined
+            if p:
+                P[i, j >> 2] |= np.uint8(p << ((j & 3) * 2))
+            dV_left = z - dH[j]
+            dH[j] = z - (left - indel)
+        dV[i] = dV_left
+    return indel * (len2 - 1) + dV.astype(np.int64).sum()
+
+
+#  Compiled score-only fill (Unrestricted Implementation)
+#  takes both sequences as uint8 arrays, the substitution cost table and indel cost, and two rows of length m,
+#  _prev_ already holding row 0
+#  returns the row holding the last row of E
+#  t: O(nm)  s: O(1) beyond the two rows
+@numba.njit(cache=True, boundscheck=False, nogil=True)
+def nw_score(seq1_arr, seq2_arr, subcost, indel, prev, curr):
+    len2 = prev.shape[0]
+    for i in range(1, seq1_arr.shape[0] + 1):
+        curr[0] = 5 * i
+        sub = subcost[seq1_arr[i - 1]]
+        for j in range(1, len2):
+            curr[j] = min(sub[seq2_arr[j - 1]] + prev[j - 1], indel + curr[j - 1], indel + prev[j])
+        prev, curr = curr, prev
+    return prev
+
+
+# The ahead-of-time build needs one entry point per dtype of the rows; the JIT dispatches on its own
+nw_score16 = nw_score32 = nw_score
+
+# Argument types of the calls GeneSequencing makes, as numba signatures for the ahead-of-time build
+_SEQ = 'u1[::1]'
+_SUBCOST = 'i1[:, ::1]'
+_SIGNATURES = {
+    'nw_fill': 'i8(%s, %s, %s, i8, i1[::1], i1[::1], u1[:, ::1])' % (_SEQ, _SEQ, _SUBCOST),
+    'nw_score16': 'i2[::1](%s, %s, %s, i8, i2[::1], i2[::1])' % (_SEQ, _SEQ, _SUBCOST),
+    'nw_score32': 'i4[::1](%s, %s, %s, i8, i4[::1], i4[::1])' % (_SEQ, _SEQ, _SUBCOST),
+}
+
+
+#  calls every kernel once on a 2 x 2 alignment with the argument types GeneSequencing uses, so they are compiled
+#  (or loaded from the cache) now rather than during the first align()
+def _warmup():
+    seq = np.frombuffer(b'aa', dtype=np.uint8)  # read-only, like the sequences GeneSequencing passes
+    subcost = np.zeros((256, 256), dtype=np.int8)
+    nw_fill(seq, seq, subcost, 5, np.empty(3, dtype=np.int8), np.empty(3, dtype=np.int8),
+            np.zeros((3, 1), dtype=np.uint8))
+    for dtype in (np.int16, np.int32):
+        nw_score(seq, seq, subcost, 5, np.zeros(3, dtype=dtype), np.empty(3, dtype=dtype))
+
+
+if __name__ == '__main__':
+    from numba.pycc import CC
+
+    cc = CC('genealign_kernels')
+    cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+    for name, signature in _SIGNATURES.items():
+        cc.export(name, signature)(globals()[name].py_func)
+    cc.compile()
+elif os.environ.get('GENEALIGN_WARMUP', '1') == '1':
+    _warmup()
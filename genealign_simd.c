@@ -0,0 +1,332 @@
+/*
+ * SIMD Needleman-Wunsch fill for GeneSequencing.py (Unrestricted Implementation).
+ *
+ * Build next to GeneSequencing.py, which loads it through ctypes when present:
+ *     cc -O3 -shared -fPIC -o genealign_simd.so genealign_simd.c
+ *
+ * Rows are taken in strips as tall as one vector, lane l holding row i0 + l.  At step t lane l computes
+ * column t - l, so every step is one anti-diagonal of the strip and all of its cells are independent: up and
+ * diagonal come from the previous lane one and two steps back, left from the same lane one step back, and
+ * lane 0 reads the row above the strip out of E.  Each step writes one cell into each of the strip's rows, so
+ * E and P are still written front to back.  The best instruction set is picked through CPUID when the library
+ * is loaded; rows left over below the last full strip are filled one at a time.
+ *
+ * E comes in two widths, chosen by the caller from the largest score the table can hold:
+ *     fill_unrestricted    int32_t scores, strips of 8 (AVX2) or 16 (AVX-512F) rows
+ *     fill_unrestricted16  int16_t scores, strips of 16 (AVX2) or 32 (AVX-512BW) rows
+ *
+ * Scoring and tie-breaking match getEditDistanceUnrestricted: MATCH = -3, SUB = 1, INDEL = 5, and the
+ * back-pointer prefers left (1) over up (2) over diagonal (0).  P is packed four 2-bit entries to a byte, rows
+ * (m + 4) / 4 bytes wide, and must come in zeroed.
+ */
+
+#include <stddef.h>
+#include <stdint.h>
+#include <stdlib.h>
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <immintrin.h>
+#define GENEALIGN_X86 1
+#endif
+
+#define MATCH (-3)
+#define INDEL 5
+#define SUB 1
+
+/* ORs back-pointer v into the packed entry of cell (i, j) */
+#define SET_P(P, pw, i, j, v) ((P)[(size_t)(i) * (pw) + ((j) >> 2)] |= (uint8_t)((v) << (((j) & 3) * 2)))
+
+/* fills row i of E & P, row i - 1 and column 0 being done */
+#define DEFINE_FILL_ROW(NAME, T)                                                                    \
+    static void NAME(const uint8_t *s1, const uint8_t *s2, int i, int m, T *E, uint8_t *P)          \
+    {                                                                                               \
+        const size_t m1 = (size_t)m + 1, pw = ((size_t)m + 4) / 4;                                  \
+        T *row = E + i * m1, *above = row - m1;                                                     \
+        for (int j = 1; j <= m; j++) {                                                              \
+            /* minimum and pointer together, ties going to left over up over diagonal */             \
+            int32_t e = row[j - 1] + INDEL, p = 1;                                                  \
+            int32_t up = above[j] + INDEL;                                                          \
+            if (up < e) {                                                                           \
+                e = up;                                                                             \
+                p = 2;                                                                              \
+            }                                                                                       \
+            int32_t diag = above[j - 1] + (s1[i - 1] == s2[j - 1] ? MATCH : SUB);                   \
+            if (diag < e) {                                                                         \
+                e = diag;                                                                           \
+                p = 0;                                                                              \
+            }                                                                                       \
+            row[j] = (T)e;                                                                          \
+            SET_P(P, pw, i, j, p);                                                                  \
+        }                                                                                           \
+    }
+
+DEFINE_FILL_ROW(fill_row32, int32_t)
+DEFINE_FILL_ROW(fill_row16, int16_t)
+
+#ifdef GENEALIGN_X86
+/*
+ * stores the lanes of one step whose column t - l lies in 1..m.  The pointers are built in a register along
+ * with the scores, by blending 2 into the lanes whose minimum is up and then 1 into those whose minimum is left,
+ * so that left wins ties over up and both over the diagonal's 0.
+ */
+#define STORE_STEP(W, e_lanes, p_lanes)                                                             \
+    for (int l = 0; l < (W); l++) {                                                                 \
+        int j = t - l;                                                                              \
+        if (j >= 1 && j <= m) {                                                                     \
+            E[(size_t)(i0 + l) * m1 + j] = (e_lanes)[l];                                            \
+            SET_P(P, (m + 4) / 4, i0 + l, j, (p_lanes)[l]);                                         \
+        }                                                                                           \
+    }
+
+/* fills rows i0 .. i0 + 7 of an int32 table; returns the next row left to fill */
+__attribute__((target("avx2")))
+static int strip32_avx2(const uint8_t *s1, const uint8_t *r2, int i0, int m, int32_t *E, uint8_t *P)
+{
+    const size_t m1 = (size_t)m + 1;
+    const int32_t *above = E + (i0 - 1) * m1;
+    const __m256i match = _mm256_set1_epi32(MATCH);
+    const __m256i sub = _mm256_set1_epi32(SUB);
+    const __m256i indel = _mm256_set1_epi32(INDEL);
+    const __m256i one = _mm256_set1_epi32(1), two = _mm256_set1_epi32(2);
+    const __m256i lane = _mm256_setr_epi32(0, 1, 2, 3, 4, 5, 6, 7);
+    const __m256i shift = _mm256_setr_epi32(0, 0, 1, 2, 3, 4, 5, 6);
+    /* seq1 characters of the strip and column 0 of its rows, one per lane */
+    const __m256i c1 = _mm256_cvtepu8_epi32(_mm_loadl_epi64((const __m128i *)(s1 + i0 - 1)));
+    int32_t e_lanes[8], p_lanes[8];
+    for (int l = 0; l < 8; l++)
+        e_lanes[l] = E[(size_t)(i0 + l) * m1];
+    const __m256i border = _mm256_loadu_si256((const __m256i *)e_lanes);
+    __m256i cur = border, prev = border;
+    for (int t = 1; t < m + 8; t++) {
+        __m256i c2 = _mm256_cvtepu8_epi32(_mm_loadl_epi64((const __m128i *)(r2 + 7 + m - t)));
+        __m256i cost = _mm256_blendv_epi8(sub, match, _mm256_cmpeq_epi32(c1, c2));
+
+        /* shift every lane down by one, lane 0 taking the row above the strip */
+        int a = t <= m ? t : m;
+        int b = t - 1 <= m ? t - 1 : m;
+        __m256i up_in = _mm256_blend_epi32(_mm256_permutevar8x32_epi32(cur, shift), _mm256_set1_epi32(above[a]), 1);
+        __m256i diag_in = _mm256_blend_epi32(_mm256_permutevar8x32_epi32(prev, shift), _mm256_set1_epi32(above[b]), 1);
+        __m256i diag = _mm256_add_epi32(diag_in, cost);
+        __m256i left = _mm256_add_epi32(cur, indel);
+        __m256i up = _mm256_add_epi32(up_in, indel);
+        __m256i e = _mm256_min_epi32(_mm256_min_epi32(diag, left), up);
+        /* lane t is at column 0 on this step */
+        e = _mm256_blendv_epi8(e, border, _mm256_cmpeq_epi32(lane, _mm256_set1_epi32(t)));
+
+        __m256i p = _mm256_and_si256(_mm256_cmpeq_epi32(e, up), two);
+        p = _mm256_blendv_epi8(p, one, _mm256_cmpeq_epi32(e, left));
+        _mm256_storeu_si256((__m256i *)e_lanes, e);
+        _mm256_storeu_si256((__m256i *)p_lanes, p);
+        STORE_STEP(8, e_lanes, p_lanes)
+        prev = cur;
+        cur = e;
+    }
+    return i0 + 8;
+}
+
+/* fills rows i0 .. i0 + 15 of an int32 table; returns the next row left to fill */
+__attribute__((target("avx512f")))
+static int strip32_avx512(const uint8_t *s1, const uint8_t *r2, int i0, int m, int32_t *E, uint8_t *P)
+{
+    const size_t m1 = (size_t)m + 1;
+    const int32_t *above = E + (i0 - 1) * m1;
+    const __m512i match = _mm512_set1_epi32(MATCH);
+    const __m512i sub = _mm512_set1_epi32(SUB);
+    const __m512i indel = _mm512_set1_epi32(INDEL);
+    const __m512i one = _mm512_set1_epi32(1), two = _mm512_set1_epi32(2);
+    const __m512i lane = _mm512_setr_epi32(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15);
+    const __m512i c1 = _mm512_cvtepu8_epi32(_mm_loadu_si128((const __m128i *)(s1 + i0 - 1)));
+    int32_t e_lanes[16], p_lanes[16];
+    for (int l = 0; l < 16; l++)
+        e_lanes[l] = E[(size_t)(i0 + l) * m1];
+    const __m512i border = _mm512_loadu_si512(e_lanes);
+    __m512i cur = border, prev = border;
+    for (int t = 1; t < m + 16; t++) {
+        __m512i c2 = _mm512_cvtepu8_epi32(_mm_loadu_si128((const __m128i *)(r2 + 15 + m - t)));
+        __m512i cost = _mm512_mask_blend_epi32(_mm512_cmpeq_epi32_mask(c1, c2), sub, match);
+
+        int a = t <= m ? t : m;
+        int b = t - 1 <= m ? t - 1 : m;
+        /* shift every lane down by one, lane 0 taking the row above the strip */
+        __m512i up_in = _mm512_alignr_epi32(cur, _mm512_set1_epi32(above[a]), 15);
+        __m512i diag_in = _mm512_alignr_epi32(prev, _mm512_set1_epi32(above[b]), 15);
+        __m512i diag = _mm512_add_epi32(diag_in, cost);
+        __m512i left = _mm512_add_epi32(cur, indel);
+        __m512i up = _mm512_add_epi32(up_in, indel);
+        __m512i e = _mm512_min_epi32(_mm512_min_epi32(diag, left), up);
+        e = _mm512_mask_blend_epi32(_mm512_cmpeq_epi32_mask(lane, _mm512_set1_epi32(t)), e, border);
+
+        __m512i p = _mm512_maskz_mov_epi32(_mm512_cmpeq_epi32_mask(e, up), two);
+        p = _mm512_mask_blend_epi32(_mm512_cmpeq_epi32_mask(e, left), p, one);
+        _mm512_storeu_si512(e_lanes, e);
+        _mm512_storeu_si512(p_lanes, p);
+        STORE_STEP(16, e_lanes, p_lanes)
+        prev = cur;
+        cur = e;
+    }
+    return i0 + 16;
+}
+
+/* fills rows i0 .. i0 + 15 of an int16 table; returns the next row left to fill */
+__attribute__((target("avx2")))
+static int strip16_avx2(const uint8_t *s1, const uint8_t *r2, int i0, int m, int16_t *E, uint8_t *P)
+{
+    const size_t m1 = (size_t)m + 1;
+    const int16_t *above = E + (i0 - 1) * m1;
+    const __m256i match = _mm256_set1_epi16(MATCH);
+    const __m256i sub = _mm256_set1_epi16(SUB);
+    const __m256i indel = _mm256_set1_epi16(INDEL);
+    const __m256i one = _mm256_set1_epi16(1), two = _mm256_set1_epi16(2);
+    const __m256i lane = _mm256_setr_epi16(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15);
+    const __m256i c1 = _mm256_cvtepu8_epi16(_mm_loadu_si128((const __m128i *)(s1 + i0 - 1)));
+    int16_t e_lanes[16], p_lanes[16];
+    for (int l = 0; l < 16; l++)
+        e_lanes[l] = E[(size_t)(i0 + l) * m1];
+    const __m256i border = _mm256_loadu_si256((const __m256i *)e_lanes);
+    __m256i cur = border, prev = border;
+    for (int t = 1; t < m + 16; t++) {
+        __m256i c2 = _mm256_cvtepu8_epi16(_mm_loadu_si128((const __m128i *)(r2 + 15 + m - t)));
+        __m256i cost = _mm256_blendv_epi8(sub, match, _mm256_cmpeq_epi16(c1, c2));
+
+        /* shift every lane down by one across the two 128-bit halves, lane 0 taking the row above the strip */
+        int a = t <= m ? t : m;
+        int b = t - 1 <= m ? t - 1 : m;
+        __m256i up_in = _mm256_alignr_epi8(cur, _mm256_permute2x128_si256(cur, cur, 0x08), 14);
+        __m256i diag_in = _mm256_alignr_epi8(prev, _mm256_permute2x128_si256(prev, prev, 0x08), 14);
+        up_in = _mm256_insert_epi16(up_in, above[a], 0);
+        diag_in = _mm256_insert_epi16(diag_in, above[b], 0);
+        __m256i diag = _mm256_add_epi16(diag_in, cost);
+        __m256i left = _mm256_add_epi16(cur, indel);
+        __m256i up = _mm256_add_epi16(up_in, indel);
+        __m256i e = _mm256_min_epi16(_mm256_min_epi16(diag, left), up);
+        e = _mm256_blendv_epi8(e, border, _mm256_cmpeq_epi16(lane, _mm256_set1_epi16((short)t)));
+
+        __m256i p = _mm256_and_si256(_mm256_cmpeq_epi16(e, up), two);
+        p = _mm256_blendv_epi8(p, one, _mm256_cmpeq_epi16(e, left));
+        _mm256_storeu_si256((__m256i *)e_lanes, e);
+        _mm256_storeu_si256((__m256i *)p_lanes, p);
+        STORE_STEP(16, e_lanes, p_lanes)
+        prev = cur;
+        cur = e;
+    }
+    return i0 + 16;
+}
+
+/* fills rows i0 .. i0 + 31 of an int16 table; returns the next row left to fill */
+__attribute__((target("avx512f,avx512bw")))
+static int strip16_avx512(const uint8_t *s1, const uint8_t *r2, int i0, int m, int16_t *E, uint8_t *P)
+{
+    const size_t m1 = (size_t)m + 1;
+    const int16_t *above = E + (i0 - 1) * m1;
+    const __m512i match = _mm512_set1_epi16(MATCH);
+    const __m512i sub = _mm512_set1_epi16(SUB);
+    const __m512i indel = _mm512_set1_epi16(INDEL);
+    const __m512i one = _mm512_set1_epi16(1), two = _mm512_set1_epi16(2);
+    int16_t e_lanes[32], p_lanes[32];
+    for (int l = 0; l < 32; l++)
+        e_lanes[l] = (int16_t)l;
+    const __m512i lane = _mm512_loadu_si512(e_lanes);
+    /* lane l takes lane l - 1 (lane 0 is overwritten right after) */
+    const __m512i shift = _mm512_max_epi16(_mm512_sub_epi16(lane, _mm512_set1_epi16(1)), _mm512_setzero_si512());
+    const __m512i c1 = _mm512_cvtepu8_epi16(_mm256_loadu_si256((const __m256i *)(s1 + i0 - 1)));
+    for (int l = 0; l < 32; l++)
+        e_lanes[l] = E[(size_t)(i0 + l) * m1];
+    const __m512i border = _mm512_loadu_si512(e_lanes);
+    __m512i cur = border, prev = border;
+    for (int t = 1; t < m + 32; t++) {
+        __m512i c2 = _mm512_cvtepu8_epi16(_mm256_loadu_si256((const __m256i *)(r2 + 31 + m - t)));
+        __m512i cost = _mm512_mask_blend_epi16(_mm512_cmpeq_epi16_mask(c1, c2), sub, match);
+
+        int a = t <= m ? t : m;
+        int b = t - 1 <= m ? t - 1 : m;
+        __m512i up_in = _mm512_mask_set1_epi16(_mm512_permutexvar_epi16(shift, cur), 1, above[a]);
+        __m512i diag_in = _mm512_mask_set1_epi16(_mm512_permutexvar_epi16(shift, prev), 1, above[b]);
+        __m512i diag = _mm512_add_epi16(diag_in, cost);
+        __m512i left = _mm512_add_epi16(cur, indel);
+        __m512i up = _mm512_add_epi16(up_in, indel);
+        __m512i e = _mm512_min_epi16(_mm512_min_epi16(diag, left), up);
+        e = _mm512_mask_blend_epi16(_mm512_cmpeq_epi16_mask(lane, _mm512_set1_epi16((short)t)), e, border);
+
+        __m512i p = _mm512_maskz_mov_epi16(_mm512_cmpeq_epi16_mask(e, up), two);
+        p = _mm512_mask_blend_epi16(_mm512_cmpeq_epi16_mask(e, left), p, one);
+        _mm512_storeu_si512(e_lanes, e);
+        _mm512_storeu_si512(p_lanes, p);
+        STORE_STEP(32, e_lanes, p_lanes)
+        prev = cur;
+        cur = e;
+    }
+    return i0 + 32;
+}
+#endif
+
+typedef int (*strip32_fn)(const uint8_t *, const uint8_t *, int, int, int32_t *, uint8_t *);
+typedef int (*strip16_fn)(const uint8_t *, const uint8_t *, int, int, int16_t *, uint8_t *);
+
+static strip32_fn strip32 = NULL;
+static strip16_fn strip16 = NULL;
+static int height32 = 1, height16 = 1;
+
+/*
+ * picks the strip functions for this CPU.  It runs once, as the library is loaded and before any fill can be
+ * called, so the fills (which GeneSequencing.py calls from several threads at once) only ever read these.
+ */
+__attribute__((constructor))
+static void pick_strips(void)
+{
+#ifdef GENEALIGN_X86
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx512f")) {
+        strip32 = strip32_avx512;
+        height32 = 16;
+    } else if (__builtin_cpu_supports("avx2")) {
+        strip32 = strip32_avx2;
+        height32 = 8;
+    }
+    if (__builtin_cpu_supports("avx512bw")) {
+        strip16 = strip16_avx512;
+        height16 = 32;
+    } else if (__builtin_cpu_supports("avx2")) {
+        strip16 = strip16_avx2;
+        height16 = 16;
+    }
+#endif
+}
+
+/*
+ * seq2 reversed behind height - 1 bytes of padding, so that the characters lane l needs on step t,
+ * s2[t - l - 1], sit at r2[height - 1 + m - t + l]; padding only meets lanes whose result is unused.
+ * Returns NULL if it could not be allocated.
+ */
+static uint8_t *reversed_padded(const uint8_t *s2, int m, int height)
+{
+    uint8_t *r2 = calloc((size_t)m + 2 * height, 1);
+    if (r2 != NULL)
+        for (int j = 1; j <= m; j++)
+            r2[height - 1 + m - j] = s2[j - 1];
+    return r2;
+}
+
+/*
+ * Both entry points fill E, (n + 1) x (m + 1) and row-major, and the packed P, both of whose first row and
+ * column are already set.
+ * They return 0 on success and -1 if the reversed copy of seq2 could not be allocated.
+ */
+#define DEFINE_FILL(NAME, T, STRIP, HEIGHT, FILL_ROW)                                               \
+    int NAME(const uint8_t *s1, int n, const uint8_t *s2, int m, T *E, uint8_t *P)                   \
+    {                                                                                               \
+        int i = 1;                                                                                  \
+        if (STRIP != NULL && m > 0 && n >= HEIGHT) {                                                \
+            uint8_t *r2 = reversed_padded(s2, m, HEIGHT);                                           \
+            if (r2 == NULL)                                                                         \
+                return -1;                                                                          \
+            while (i + HEIGHT - 1 <= n)                                                             \
+                i = STRIP(s1, r2, i, m, E, P);                                                      \
+            free(r2);                                                                               \
+        }                                                                                           \
+        for (; i <= n; i++)                                                                         \
+            FILL_ROW(s1, s2, i, m, E, P);                                                           \
+        return 0;                                                                                   \
+    }
+
+DEFINE_FILL(fill_unrestricted, int32_t, strip32, height32, fill_row32)
+DEFINE_FILL(fill_unrestricted16, int16_t, strip16, height16, fill_row16)
@@ -0,0 +1,45 @@
+# cython: language_level=3
+#
+# Cython Needleman-Wunsch fill for GeneSequencing.py (Unrestricted Implementation), used when numba is not
+# available.  Build it in place, next to GeneSequencing.py:
+#     python setup.py build_ext --inplace
+
+cimport cython
+
+# E may hold int16 or int32 scores (see _score_dtype in GeneSequencing.py)
+ctypedef fused score_t:
+    short
+    int
+
+
+#  takes both sequences as uint8 arrays, the substitution cost table and indel cost, the E table and the packed P,
+#  both with their first row and column set
+#  fills the rest of E & P in place, using the same tie-breaking as getEditDistanceUnrestricted: left over up over
+#  diagonal.  The GIL is released for the whole fill.
+#  t: O(nm)  s: O(1) beyond the tables
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cpdef nw_fill(const unsigned char[::1] s1, const unsigned char[::1] s2, const signed char[:, ::1] subcost,
+              int indel, score_t[:, ::1] E, unsigned char[:, ::1] P):
+    cdef Py_ssize_t n = s1.shape[0], m = s2.shape[0], i, j
+    cdef const signed char *sub
+    cdef int e, up, diag, p
+    with nogil:
+        for i in range(1, n + 1):
+            sub = &subcost[s1[i - 1], 0]
+            for j in range(1, m + 1):
+                # minimum and pointer together
+                e = E[i, j - 1] + indel  # left
+                p = 1
+                up = E[i - 1, j] + indel
+                if up < e:
+                    e = up
+                    p = 2
+                diag = E[i - 1, j - 1] + sub[s2[j - 1]]
+                if diag < e:
+                    e = diag
+                    p = 0
+                E[i, j] = <score_t>e
+                if p:
+                    P[i, j >> 2] |= <unsigned char>(p << ((j & 3) * 2))
@@ -0,0 +1,10 @@
+# Builds the optional Cython fill (nw_cython.pyx) in place, next to GeneSequencing.py:
+#     python setup.py build_ext --inplace
+
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name='GeneSequencing',
+    ext_modules=cythonize('nw_cython.pyx'),
+)